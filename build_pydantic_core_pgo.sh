@@ -0,0 +1,71 @@
+#!/bin/bash
+# Build a profile-guided-optimized pydantic-core wheel on the deployment
+# target, using this app's own validation workload as the profiling input.
+# PGO builds show ~15-30% wins on the model/list/dict paths that dominate
+# Product/Cart handling. Requires: rust toolchain, maturin, llvm-profdata.
+set -euo pipefail
+
+APP_DIR="$(cd "$(dirname "$0")" && pwd)"
+PGO_DIR="${PGO_DIR:-/tmp/pgo-pydantic-core}"
+CORE_VERSION=$(python -c "import pydantic_core; print(pydantic_core.__version__)")
+SRC_DIR="$PGO_DIR/pydantic-core-src"
+
+# Never leave the environment on the instrumented (profile-generate)
+# wheel if a later step fails.
+restore_original() {
+  echo "Build failed; restoring pydantic_core==$CORE_VERSION" >&2
+  pip install --force-reinstall "pydantic_core==$CORE_VERSION"
+}
+trap restore_original ERR
+
+mkdir -p "$PGO_DIR"
+if [ ! -d "$SRC_DIR" ]; then
+  git clone --depth 1 --branch "v$CORE_VERSION" https://github.com/pydantic/pydantic-core "$SRC_DIR"
+fi
+
+run_workload() {
+  # Exercise the exact validators the app runs in production: Product
+  # construction/dump (get_product, /seed) and cart item validation.
+  # PYTHONPATH makes main/schemas importable from the pydantic-core
+  # checkout this script cd's into.
+  PYTHONPATH="$APP_DIR" python - <<'EOF'
+from main import _SEED_DOC, _CART_ITEMS_ADAPTER
+from schemas import Product
+
+items = [
+    {
+        "product_slug": "rubber-gym-mat-pro",
+        "sku": "MAT10-BLK-100",
+        "quantity": 2,
+        "price": 49.99,
+        "title": "Premium Rubber Gym Mat",
+        "image": "/images/mat-1.jpg",
+        "selected_options": {"Thickness": "10mm", "Size": "1m x 1m", "Color": "Black"},
+    }
+] * 20
+
+for _ in range(20000):
+    product = Product(**_SEED_DOC)
+    product.model_dump_json()
+    _CART_ITEMS_ADAPTER.validate_python(items)
+EOF
+}
+
+cd "$SRC_DIR"
+
+echo "Building instrumented pydantic-core..."
+RUSTFLAGS="-C profile-generate=$PGO_DIR/profdata" \
+  maturin build --release --out "$PGO_DIR/instrumented"
+pip install --force-reinstall "$PGO_DIR"/instrumented/pydantic_core-*.whl
+
+echo "Running profiling workload..."
+run_workload
+llvm-profdata merge -o "$PGO_DIR/merged.profdata" "$PGO_DIR/profdata"
+
+echo "Building optimized pydantic-core..."
+RUSTFLAGS="-C profile-use=$PGO_DIR/merged.profdata" \
+  maturin build --release --out "$PGO_DIR/optimized"
+pip install --force-reinstall "$PGO_DIR"/optimized/pydantic_core-*.whl
+trap - ERR
+
+echo "PGO wheel installed from $PGO_DIR/optimized"
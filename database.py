@@ -5,7 +5,10 @@ MongoDB helper functions ready to use in your backend code.
 Import and use these functions in your API endpoints for database operations.
 """
 
-from pymongo import MongoClient
+from motor.motor_asyncio import AsyncIOMotorClient
+from bson.codec_options import CodecOptions
+from bson.raw_bson import RawBSONDocument
+import redis.asyncio as aioredis
 from datetime import datetime, timezone
 import os
 from dotenv import load_dotenv
@@ -17,16 +20,41 @@ load_dotenv()
 
 _client = None
 db = None
+raw_db = None
+redis_client = None
 
 database_url = os.getenv("DATABASE_URL")
 database_name = os.getenv("DATABASE_NAME")
+redis_url = os.getenv("REDIS_URL")
 
 if database_url and database_name:
-    _client = MongoClient(database_url)
+    # Coroutines multiplex over few connections, so a pool of ~2x CPU is
+    # plenty; the driver default of 100 just wastes descriptors. A small
+    # warm minimum avoids TLS handshakes on cold requests, and wire
+    # compression trades cheap CPU for bytes (zlib is the stdlib
+    # fallback when zstd/snappy are not installed).
+    _client = AsyncIOMotorClient(
+        database_url,
+        maxPoolSize=2 * (os.cpu_count() or 2),
+        minPoolSize=2,
+        compressors="zstd,snappy,zlib",
+        retryWrites=True,
+        waitQueueTimeoutMS=2000,
+    )
     db = _client[database_name]
+    # Same database, but documents come back as RawBSONDocument (lazy
+    # bytes) so read paths that only re-serialize can skip building a
+    # full Python dict tree per document.
+    raw_db = _client.get_database(
+        database_name,
+        codec_options=CodecOptions(document_class=RawBSONDocument),
+    )
+
+if redis_url:
+    redis_client = aioredis.from_url(redis_url)
 
 # Helper functions for common database operations
-def create_document(collection_name: str, data: Union[BaseModel, dict]):
+async def create_document(collection_name: str, data: Union[BaseModel, dict]):
     """Insert a single document with timestamp"""
     if db is None:
         raise Exception("Database not available. Check DATABASE_URL and DATABASE_NAME environment variables.")
@@ -40,16 +68,29 @@ def create_document(collection_name: str, data: Union[BaseModel, dict]):
     data_dict['created_at'] = datetime.now(timezone.utc)
     data_dict['updated_at'] = datetime.now(timezone.utc)
 
-    result = db[collection_name].insert_one(data_dict)
+    result = await db[collection_name].insert_one(data_dict)
     return str(result.inserted_id)
 
-def get_documents(collection_name: str, filter_dict: dict = None, limit: int = None):
+async def get_products_by_slugs(slugs: list, projection: dict = None):
+    """Fetch many products in one $in query, keyed by slug.
+
+    Batch endpoints (e.g. rendering a cart with product metadata per
+    item) should collect all slugs first and call this once instead of
+    issuing a find_one per slug (the classic N+1 pattern).
+    """
+    if db is None:
+        raise Exception("Database not available. Check DATABASE_URL and DATABASE_NAME environment variables.")
+
+    cursor = db["product"].find({"slug": {"$in": slugs}}, projection)
+    return {doc["slug"]: doc async for doc in cursor}
+
+async def get_documents(collection_name: str, filter_dict: dict = None, limit: int = None):
     """Get documents from collection"""
     if db is None:
         raise Exception("Database not available. Check DATABASE_URL and DATABASE_NAME environment variables.")
-    
+
     cursor = db[collection_name].find(filter_dict or {})
     if limit:
         cursor = cursor.limit(limit)
-    
-    return list(cursor)
+
+    return [doc async for doc in cursor]
@@ -1,24 +1,72 @@
+import hashlib
 import os
-from fastapi import FastAPI, HTTPException
+import time
+from fastapi import FastAPI, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import ORJSONResponse
+from pydantic import BaseModel, Field, TypeAdapter
 from typing import List, Optional
-from bson import ObjectId
+import bson
+import orjson
 
-from database import db, create_document, get_documents
+from database import db, raw_db, redis_client, create_document, get_documents
 from schemas import Product, Cart, CartItem
 
-app = FastAPI()
+# Product docs are read-mostly; a short TTL keeps the cache honest
+# without a full invalidation protocol.
+PRODUCT_CACHE_TTL = 60
 
+# Browsers/CDNs may cache product pages for 5 minutes and revalidate
+# with If-None-Match afterwards; a 304 never touches Mongo or Pydantic.
+PRODUCT_CACHE_CONTROL = "public, max-age=300"
+
+
+def _product_etag(slug: str, updated_at) -> str:
+    # RFC 9110 entity-tags are DQUOTE-delimited; proxies may drop or
+    # rewrite unquoted ones, breaking If-None-Match revalidation.
+    digest = hashlib.blake2b(f"{slug}:{updated_at}".encode()).hexdigest()[:16]
+    return f'"{digest}"'
+
+
+# Shared validator for cart item lists, built once at import. Anything
+# hydrating items from outside a handler's own writes should reuse this
+# instead of constructing models one by one.
+_CART_ITEMS_ADAPTER = TypeAdapter(List[CartItem])
+
+app = FastAPI(default_response_class=ORJSONResponse)
+
+# Product payloads carry several KB of description/faq text; gzip them
+# once per response. Small bodies (carts, health checks) pass through.
+app.add_middleware(GZipMiddleware, minimum_size=1024, compresslevel=5)
+
+# Match origins with one compiled regex, narrow methods/headers to what
+# the API uses, and let browsers cache the preflight for a day. Nothing
+# here uses cookies, so credentials stay disabled -- with them enabled a
+# permissive regex would reflect arbitrary origins as credentialed.
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+    allow_origin_regex=os.getenv("CORS_ORIGIN_REGEX", r"https?://.*"),
+    allow_methods=["GET", "POST"],
+    allow_headers=["content-type"],
+    max_age=86400,
 )
 
 
+@app.on_event("startup")
+async def create_indexes():
+    # Keep the hot lookups (slug, cart_id, variant sku) on B-tree probes
+    # instead of collection scans. create_index is a no-op if it exists.
+    if db is None:
+        return
+    await db["product"].create_index("slug", unique=True)
+    await db["cart"].create_index("cart_id", unique=True)
+    await db["product"].create_index(
+        "variants.sku",
+        partialFilterExpression={"variants.sku": {"$exists": True}},
+    )
+
+
 @app.get("/")
 def read_root():
     return {"message": "Gym Mats API"}
@@ -26,141 +74,206 @@ def read_root():
 
 # Utility converters
 
-def product_doc_to_model(doc) -> Product:
-    # Convert Mongo doc to Product model compatible dict
-    if not doc:
-        raise HTTPException(status_code=404, detail="Product not found")
-    # Remove _id or convert to string if needed
-    doc = dict(doc)
-    if "_id" in doc:
-        doc["_id"] = str(doc["_id"])  # not used on frontend but safe
-    return Product(**doc)
+# Everything in the Product schema except the internal write-time
+# variants_by_sku index, which would duplicate the variants array.
+_PUBLIC_PRODUCT_FIELDS = frozenset(Product.model_fields) - {"variants_by_sku"}
+
+
+def product_doc_to_json(doc: dict) -> bytes:
+    # Serialize straight to JSON bytes, keeping only the public Product
+    # fields (drops _id and the created_at/updated_at timestamps).
+    return orjson.dumps({k: v for k, v in doc.items() if k in _PUBLIC_PRODUCT_FIELDS})
+
+
+# Default rubber gym mat product, validated once at import time so /seed
+# only has to insert the pre-built dict.
+_SEED_DOC = Product(
+    title="Premium Rubber Gym Mat",
+    slug="rubber-gym-mat-pro",
+    subtitle="Anti-slip, shock-absorbing flooring for serious lifters",
+    description=(
+        "Durable, dense rubber mats engineered to protect your floors and equipment. "
+        "Low odor, easy to clean, and built for heavy use in home or commercial gyms."
+    ),
+    base_price=49.99,
+    images=[
+        {"url": "/images/mat-1.jpg", "alt": "Gym mat close-up texture"},
+        {"url": "/images/mat-2.jpg", "alt": "Mat with barbell on top"},
+        {"url": "/images/mat-3.jpg", "alt": "Home gym setup with mats"},
+    ],
+    primary_image="/images/mat-1.jpg",
+    variants=[
+        {
+            "sku": "MAT10-BLK-100",
+            "thickness_mm": 10,
+            "size": "1m x 1m",
+            "color": "Black",
+            "price": 49.99,
+            "stock": 120,
+        },
+        {
+            "sku": "MAT15-BLK-100",
+            "thickness_mm": 15,
+            "size": "1m x 1m",
+            "color": "Black",
+            "price": 64.99,
+            "stock": 80,
+        },
+        {
+            "sku": "MAT20-GRY-100",
+            "thickness_mm": 20,
+            "size": "1m x 1m",
+            "color": "Speckled Grey",
+            "price": 79.99,
+            "stock": 50,
+        },
+    ],
+    specs={
+        "Material": "Recycled vulcanized rubber",
+        "Surface": "Anti-slip fine grain",
+        "Hardness": "60 Shore A",
+        "Smell": "Low-odor",
+        "Maintenance": "Mop with mild detergent",
+    },
+    uvps=[
+        "Shock-absorbing protection for floors and equipment",
+        "Anti-slip surface with low odor",
+        "Precision-cut edges for seamless fit",
+        "Easy clean, water-resistant finish",
+        "Backed by 2-year commercial warranty",
+    ],
+    faqs=[
+        {
+            "question": "Can I cut the mats to fit my space?",
+            "answer": "Yes, use a sharp utility knife and straight edge to score and cut."
+        },
+        {
+            "question": "Do these reduce noise?",
+            "answer": "The dense rubber helps dampen sound from drops and footsteps."
+        },
+        {
+            "question": "Are they safe for basement floors?",
+            "answer": "Yes, they are water-resistant and safe on concrete."
+        }
+    ],
+    rating=4.9,
+    reviews_count=312,
+    in_stock=True,
+).model_dump()
+_SEED_DOC["variants_by_sku"] = {v["sku"]: v for v in _SEED_DOC["variants"]}
 
 
 # Seed a default rubber gym mat product if not exists
 @app.post("/seed")
-def seed_product():
+async def seed_product():
     if db is None:
         raise HTTPException(status_code=500, detail="Database not available")
-    existing = db["product"].find_one({"slug": "rubber-gym-mat-pro"})
+    existing = await db["product"].find_one({"slug": _SEED_DOC["slug"]})
     if existing:
         return {"status": "exists"}
 
-    product = Product(
-        title="Premium Rubber Gym Mat",
-        slug="rubber-gym-mat-pro",
-        subtitle="Anti-slip, shock-absorbing flooring for serious lifters",
-        description=(
-            "Durable, dense rubber mats engineered to protect your floors and equipment. "
-            "Low odor, easy to clean, and built for heavy use in home or commercial gyms."
-        ),
-        base_price=49.99,
-        images=[
-            {"url": "/images/mat-1.jpg", "alt": "Gym mat close-up texture"},
-            {"url": "/images/mat-2.jpg", "alt": "Mat with barbell on top"},
-            {"url": "/images/mat-3.jpg", "alt": "Home gym setup with mats"},
-        ],
-        variants=[
-            {
-                "sku": "MAT10-BLK-100",
-                "thickness_mm": 10,
-                "size": "1m x 1m",
-                "color": "Black",
-                "price": 49.99,
-                "stock": 120,
-            },
-            {
-                "sku": "MAT15-BLK-100",
-                "thickness_mm": 15,
-                "size": "1m x 1m",
-                "color": "Black",
-                "price": 64.99,
-                "stock": 80,
-            },
-            {
-                "sku": "MAT20-GRY-100",
-                "thickness_mm": 20,
-                "size": "1m x 1m",
-                "color": "Speckled Grey",
-                "price": 79.99,
-                "stock": 50,
-            },
-        ],
-        specs={
-            "Material": "Recycled vulcanized rubber",
-            "Surface": "Anti-slip fine grain",
-            "Hardness": "60 Shore A",
-            "Smell": "Low-odor",
-            "Maintenance": "Mop with mild detergent",
-        },
-        uvps=[
-            "Shock-absorbing protection for floors and equipment",
-            "Anti-slip surface with low odor",
-            "Precision-cut edges for seamless fit",
-            "Easy clean, water-resistant finish",
-            "Backed by 2-year commercial warranty",
-        ],
-        faqs=[
-            {
-                "question": "Can I cut the mats to fit my space?",
-                "answer": "Yes, use a sharp utility knife and straight edge to score and cut."
-            },
-            {
-                "question": "Do these reduce noise?",
-                "answer": "The dense rubber helps dampen sound from drops and footsteps."
-            },
-            {
-                "question": "Are they safe for basement floors?",
-                "answer": "Yes, they are water-resistant and safe on concrete."
-            }
-        ],
-        rating=4.9,
-        reviews_count=312,
-        in_stock=True,
-    )
-
-    _id = create_document("product", product)
+    _id = await create_document("product", dict(_SEED_DOC))
+    if redis_client is not None:
+        try:
+            await redis_client.delete(
+                f"product:{_SEED_DOC['slug']}", f"product:{_SEED_DOC['slug']}:etag"
+            )
+        except Exception:
+            pass  # worst case the stale entry lives out its short TTL
     return {"status": "seeded", "id": _id}
 
 
-@app.get("/api/products/{slug}", response_model=Product)
-def get_product(slug: str):
+@app.get("/api/products/{slug}", response_class=ORJSONResponse)
+async def get_product(slug: str, request: Request):
     if db is None:
         raise HTTPException(status_code=500, detail="Database not available")
-    doc = db["product"].find_one({"slug": slug})
-    return product_doc_to_model(doc)
+    if_none_match = request.headers.get("if-none-match")
+    if redis_client is not None:
+        # Redis is an accelerator, not a dependency: on any cache error
+        # fall through to the Mongo path.
+        try:
+            cached, etag = await redis_client.mget(
+                f"product:{slug}", f"product:{slug}:etag"
+            )
+        except Exception:
+            cached = etag = None
+        if cached:
+            etag = etag.decode() if isinstance(etag, bytes) else etag
+            headers = {"Cache-Control": PRODUCT_CACHE_CONTROL}
+            if etag:
+                headers["ETag"] = etag
+                if if_none_match == etag:
+                    return Response(status_code=304, headers=headers)
+            # Serve the cached JSON as-is, skipping Mongo and Pydantic.
+            return Response(
+                content=cached, media_type="application/json", headers=headers
+            )
+    # Fetch as raw BSON and decode once straight into JSON bytes: no
+    # Pydantic model in between (the doc was validated when written).
+    raw = await raw_db["product"].find_one({"slug": slug})
+    if raw is None:
+        raise HTTPException(status_code=404, detail="Product not found")
+    doc = bson.decode(raw.raw)
+    etag = _product_etag(slug, doc.get("updated_at"))
+    headers = {"ETag": etag, "Cache-Control": PRODUCT_CACHE_CONTROL}
+    if if_none_match == etag:
+        return Response(status_code=304, headers=headers)
+    body = product_doc_to_json(doc)
+    if redis_client is not None:
+        try:
+            async with redis_client.pipeline(transaction=False) as pipe:
+                pipe.setex(f"product:{slug}", PRODUCT_CACHE_TTL, body)
+                pipe.setex(f"product:{slug}:etag", PRODUCT_CACHE_TTL, etag)
+                await pipe.execute()
+        except Exception:
+            pass  # best-effort cache fill; the response is already built
+    return Response(content=body, media_type="application/json", headers=headers)
 
 
 class AddToCartRequest(BaseModel):
     cart_id: str
     product_slug: str
-    sku: str
+    # skus are interpolated into a Mongo field path, so reject anything
+    # that is not a plain sku token ($-prefixes, dots, empty strings)
+    sku: str = Field(..., pattern=r"^[A-Za-z0-9][A-Za-z0-9_-]*$")
     quantity: int = 1
 
 
 @app.post("/api/cart/add")
-def add_to_cart(payload: AddToCartRequest):
+async def add_to_cart(payload: AddToCartRequest):
     if db is None:
         raise HTTPException(status_code=500, detail="Database not available")
 
-    product = db["product"].find_one({"slug": payload.product_slug})
+    # Project only what the cart item needs: title, first image and the
+    # matching variant via the write-time variants_by_sku index, instead
+    # of decoding (and scanning) the whole variants list.
+    product = await db["product"].find_one(
+        {"slug": payload.product_slug},
+        projection={
+            "title": 1,
+            "primary_image": 1,
+            "images": {"$slice": 1},
+            f"variants_by_sku.{payload.sku}": 1,
+            "variants": {"$elemMatch": {"sku": payload.sku}},
+        },
+    )
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
 
-    # find variant
-    variant = next((v for v in product.get("variants", []) if v.get("sku") == payload.sku), None)
+    variant = (product.get("variants_by_sku") or {}).get(payload.sku)
+    if variant is None:
+        # Docs written before variants_by_sku existed only carry the list
+        variant = (product.get("variants") or [None])[0]
     if not variant:
         raise HTTPException(status_code=404, detail="Variant not found")
 
-    # Create/update cart document
-    cart = db["cart"].find_one({"cart_id": payload.cart_id})
     item = {
         "product_slug": payload.product_slug,
         "sku": payload.sku,
         "quantity": payload.quantity,
         "price": variant.get("price"),
         "title": product.get("title"),
-        "image": (product.get("images") or [{}])[0].get("url"),
+        "image": product.get("primary_image") or (product.get("images") or [{}])[0].get("url"),
         "selected_options": {
             "Thickness": f"{variant.get('thickness_mm')}mm",
             "Size": variant.get("size"),
@@ -168,44 +281,64 @@ def add_to_cart(payload: AddToCartRequest):
         },
     }
 
-    if cart:
-        # If item with same sku exists, increase quantity
-        updated = False
-        for it in cart.get("items", []):
-            if it.get("sku") == payload.sku:
-                it["quantity"] = it.get("quantity", 0) + payload.quantity
-                updated = True
-                break
-        if not updated:
-            cart.setdefault("items", []).append(item)
-        db["cart"].update_one({"_id": cart["_id"]}, {"$set": cart})
-    else:
-        db["cart"].insert_one({"cart_id": payload.cart_id, "items": [item], "currency": "USD"})
+    # Atomically bump quantity if the sku is already in the cart;
+    # otherwise push the new item (creating the cart on first add).
+    result = await db["cart"].update_one(
+        {"cart_id": payload.cart_id, "items.sku": payload.sku},
+        {"$inc": {"items.$.quantity": payload.quantity}},
+    )
+    if result.matched_count == 0:
+        await db["cart"].update_one(
+            {"cart_id": payload.cart_id},
+            {"$setOnInsert": {"currency": "USD"}, "$push": {"items": item}},
+            upsert=True,
+        )
 
     return {"status": "ok"}
 
 
-@app.get("/api/cart/{cart_id}", response_model=Cart)
-def get_cart(cart_id: str):
+@app.get("/api/cart/{cart_id}")
+async def get_cart(cart_id: str):
     if db is None:
         raise HTTPException(status_code=500, detail="Database not available")
-    cart = db["cart"].find_one({"cart_id": cart_id})
+    # Project only the Cart schema fields and pin the unique cart_id
+    # index so the lookup never falls back to a collection scan.
+    cart = await db["cart"].find_one(
+        {"cart_id": cart_id},
+        projection={"_id": 0, "cart_id": 1, "items": 1, "currency": 1},
+        hint="cart_id_1",
+    )
     if not cart:
         return Cart(cart_id=cart_id, items=[], currency="USD")
-    cart["_id"] = str(cart["_id"]) if "_id" in cart else None
-    return Cart(**cart)
+    # One amortized pass through the shared adapter covers items written
+    # by older schema versions; the Cart wrapper itself is our own data,
+    # so model_construct skips its validators.
+    items = _CART_ITEMS_ADAPTER.validate_python(cart.get("items", []))
+    return Cart.model_construct(
+        cart_id=cart_id, items=items, currency=cart.get("currency", "USD")
+    )
+
+
+# Static /test skeleton built once; health probes hit this endpoint
+# every few seconds, so per-call work should be a dict copy.
+_TEST_RESPONSE_SKELETON = {
+    "backend": "✅ Running",
+    "database": "❌ Not Available",
+    "database_url": None,
+    "database_name": None,
+    "connection_status": "Not Connected",
+    "collections": []
+}
+
+# list_collection_names is an admin command (~2-10ms); cache it so
+# frequent health checks don't pay a Mongo round-trip each time.
+HEALTH_CACHE_TTL = 30
+_HEALTH_CACHE = {"ts": 0.0, "collections": None}
 
 
 @app.get("/test")
-def test_database():
-    response = {
-        "backend": "✅ Running",
-        "database": "❌ Not Available",
-        "database_url": None,
-        "database_name": None,
-        "connection_status": "Not Connected",
-        "collections": []
-    }
+async def test_database():
+    response = dict(_TEST_RESPONSE_SKELETON)
 
     try:
         if db is not None:
@@ -214,7 +347,11 @@ def test_database():
             response["database_name"] = db.name if hasattr(db, 'name') else "✅ Connected"
             response["connection_status"] = "Connected"
             try:
-                collections = db.list_collection_names()
+                collections = _HEALTH_CACHE["collections"]
+                if collections is None or time.monotonic() - _HEALTH_CACHE["ts"] >= HEALTH_CACHE_TTL:
+                    collections = await db.list_collection_names()
+                    _HEALTH_CACHE["collections"] = collections
+                    _HEALTH_CACHE["ts"] = time.monotonic()
                 response["collections"] = collections[:10]
                 response["database"] = "✅ Connected & Working"
             except Exception as e:
@@ -225,7 +362,6 @@ def test_database():
     except Exception as e:
         response["database"] = f"❌ Error: {str(e)[:50]}"
 
-    import os
     response["database_url"] = "✅ Set" if os.getenv("DATABASE_URL") else "❌ Not Set"
     response["database_name"] = "✅ Set" if os.getenv("DATABASE_NAME") else "❌ Not Set"
 
@@ -235,4 +371,12 @@ def test_database():
 if __name__ == "__main__":
     import uvicorn
     port = int(os.getenv("PORT", 8000))
-    uvicorn.run(app, host="0.0.0.0", port=port)
+    # libuv event loop + C HTTP parser; one worker per core by default.
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=port,
+        loop="uvloop",
+        http="httptools",
+        workers=int(os.getenv("WEB_CONCURRENCY", os.cpu_count() or 1)),
+    )
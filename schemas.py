@@ -46,7 +46,13 @@ class Product(BaseModel):
     base_price: float = Field(..., ge=0, description="Reference price")
     category: str = "Gym Mats"
     images: List[Image] = []
+    # Denormalized copy of images[0].url so hot paths can project a
+    # single scalar instead of the images array
+    primary_image: Optional[str] = None
     variants: List[Variant] = []
+    # Write-time index over variants so a single sku can be projected
+    # with a dotted path instead of scanning the list
+    variants_by_sku: Dict[str, Variant] = {}
     specs: Dict[str, str] = {}
     uvps: List[str] = []  # Unique value propositions
     faqs: List[FAQItem] = []
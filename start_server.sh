@@ -15,5 +15,5 @@ mkdir -p logs
 echo "Installing dependencies..."
 pip install -r requirements.txt
 echo "Starting FastAPI server..."
-nohup uvicorn main:app --host 0.0.0.0 --port 8000 --reload > logs/server.log 2>&1 
+nohup uvicorn main:app --host 0.0.0.0 --port 8000 --loop uvloop --http httptools --workers "${WEB_CONCURRENCY:-2}" > logs/server.log 2>&1
 echo "Server started in background"